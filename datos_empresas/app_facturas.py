@@ -1,29 +1,166 @@
 import pandas as pd
 import numpy as np
 import re
-from datetime import datetime
+import functools
 import io
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
+import xlsxwriter
+
+# Separador entre tipo de venta e incoterm en la condición de venta (ej. "FIRME - FOB")
+CONDICION_SEPARATOR_RE = re.compile(r'\s*[-–]\s*')
+
+# Palabras que marcan el fin de la tabla de productos en la columna de descripción
+STOP_WORDS_RE = re.compile(r'TOTAL|OBSERVACIONES|NOTES|SUBTOTAL')
+
+# Columnas de cada línea de producto, en el orden del reporte
+PRODUCT_COLUMNS = ["CANTIDAD", "DESCRIPCION", "PRECIO UNITARIO", "TOTAL LINEA"]
+
+# Mapeo de meses a números para formato estándar
+MONTH_MAP = {
+    'JANUARY': '01', 'JAN': '01', 'ENERO': '01', 'ENE': '01', '1': '01', '01': '01',
+    'FEBRUARY': '02', 'FEB': '02', 'FEBRERO': '02', '2': '02', '02': '02',
+    'MARCH': '03', 'MAR': '03', 'MARZO': '03', '3': '03', '03': '03',
+    'APRIL': '04', 'APR': '04', 'ABRIL': '04', 'ABR': '04', '4': '04', '04': '04',
+    'MAY': '05', 'MAYO': '05', '5': '05', '05': '05',
+    'JUNE': '06', 'JUN': '06', 'JUNIO': '06', '6': '06', '06': '06',
+    'JULY': '07', 'JUL': '07', 'JULIO': '07', '7': '07', '07': '07',
+    'AUGUST': '08', 'AUG': '08', 'AGOSTO': '08', 'AGO': '08', '8': '08', '08': '08',
+    'SEPTEMBER': '09', 'SEP': '09', 'SEPTIEMBRE': '09', 'SEPT': '09', '9': '09', '09': '09',
+    'OCTOBER': '10', 'OCT': '10', 'OCTUBRE': '10', '10': '10',
+    'NOVEMBER': '11', 'NOV': '11', 'NOVIEMBRE': '11', '11': '11',
+    'DECEMBER': '12', 'DEC': '12', 'DICIEMBRE': '12', 'DIC': '12', '12': '12'
+}
+
+# Palabras clave de cada etiqueta de la factura; una etiqueta coincide con la primera celda
+# donde aparece alguna de ellas como palabra completa
+LABEL_KEYWORDS = {
+    "CLIENTE": ("CLIENTE", "CUSTOMER"),
+    "EXP": ("EXP", "EXP N°", "REF EXP"),
+    "DIA": ("DIA", "DIA / DAY"),
+    "MES": ("MES", "MES / MONTH"),
+    "AÑO": ("AÑO", "AÑO / YEAR", "YEAR"),
+    "FECHA": ("FECHA", "DATE", "FECHA DOCUMENTO"),
+    "CONDICION VENTA": ("CONDICION VENTA", "CONDICION DE VENTA", "TERMS OF SALE"),
+    "PUERTO EMBARQUE": ("PUERTO EMBARQUE", "PORT OF LOADING"),
+    "PUERTO DESTINO": ("PUERTO DESTINO", "PORT OF DESTINATION", "DISCHARGING PORT"),
+    "MONEDA": ("MONEDA", "CURRENCY"),
+    "TOTAL FOB": ("TOTAL FOB", "TOTAL VALUE"),
+    "ORIGEN": ("COUNTRY OF ORIGIN", "COUNTRY OF ORIGIN: CHILE", "ORIGIN: CHILE"),
+    "OBSERVACIONES": ("OBSERVACIONES", "OBSERVATIONS", "NOTES", "COMENTARIOS"),
+    "DESCRIPCION": ("DESCRIPCION", "DESCRIPTION", "MERCHANDISE DESCRIPTION"),
+    "CANTIDAD": ("CANTIDAD", "QTY", "QUANTITY"),
+    "PRECIO": ("PRECIO UNIT", "UNIT PRICE", "PRECIO"),
+    "TOTAL": ("TOTAL", "TOTAL LINEA"),
+}
+
+# Etiquetas que process() lee siempre: se resuelven juntas en un solo recorrido.
+# Las demás se leen solo según lo encontrado (MES y AÑO si hay DIA; CANTIDAD, PRECIO y TOTAL
+# si hay DESCRIPCION; FECHA, TOTAL FOB y OBSERVACIONES como respaldo) y se buscan aparte
+# cuando hacen falta, para que una etiqueta que no se llega a leer no alargue el recorrido.
+CORE_LABELS = ("CLIENTE", "EXP", "DIA", "CONDICION VENTA", "PUERTO EMBARQUE", "PUERTO DESTINO",
+               "MONEDA", "ORIGEN", "DESCRIPCION")
+
+# Desde cuántas palabras clave pendientes conviene filtrar cada celda con una sola regex;
+# con menos, las pruebas directas de subcadena son más rápidas (sobre todo en celdas largas)
+MIN_PATTERN_KEYWORDS = 8
+
+@functools.lru_cache(maxsize=256)
+def _keyword_needles(keywords):
+    """Devuelve los patrones ' PALABRA ' en mayúsculas para una tupla de palabras clave."""
+    return tuple(f" {k.upper()} " for k in keywords)
+
+@functools.lru_cache(maxsize=256)
+def _keywords_pattern(keywords):
+    """
+    Compila una alternativa con todas las palabras clave, sin exigir palabra completa:
+    sirve de filtro previo y la coincidencia se confirma con los patrones ' PALABRA '.
+    """
+    return re.compile('|'.join(re.escape(k.upper()) for k in keywords))
 
 class InvoiceParser:
     def __init__(self, df):
         # Convertimos el dataframe a una matriz de cadenas para facilitar la búsqueda
-        # Aseguramos que todo sea texto para evitar errores con floats
-        self.df = df.astype(str).replace('nan', '')
-        self.raw_data = self.df.values 
-
-    def _find_coordinates(self, keywords):
-        """Busca las coordenadas (fila, columna) de una palabra clave."""
-        if isinstance(keywords, str):
-            keywords = [keywords]
-        keywords = [k.upper() for k in keywords]
-        
-        for r_idx, row in enumerate(self.raw_data):
+        # Aseguramos que todo sea texto para evitar errores con floats.
+        # Solo se conserva la matriz de texto, no una copia del DataFrame.
+        # (según la versión de pandas, astype(str) deja los NaN como 'nan' o como NaN)
+        values = df.astype(str).fillna('').to_numpy(dtype=object)
+        # Se limpian los NaN y se recortan los espacios de toda la matriz en una sola pasada,
+        # no en cada lectura de celda. Se guarda como cadenas de Python (dtype=object), sin el
+        # relleno de un arreglo de texto de ancho fijo.
+        cells = ['' if text == 'nan' else text.strip() for text in values.ravel().tolist()]
+        self.raw_data = np.array(cells, dtype=object).reshape(values.shape)
+        # Filas como listas de Python, para recorrerlas en orden fila/columna. Su versión en
+        # mayúsculas se calcula por fila la primera vez que un recorrido llega a ella
+        self._raw_rows = self.raw_data.tolist()
+        self._norm_rows = []
+        # Mayúsculas de cada valor distinto ya convertido
+        self._upper_cache = {}
+        # Coordenadas ya resueltas de cada etiqueta
+        self._coords = {}
+
+    def _locate(self, labels):
+        """
+        Resuelve varias etiquetas de LABEL_KEYWORDS en un solo recorrido fila por fila,
+        que se detiene en cuanto todas tienen coincidencia. Las ya resueltas no se vuelven a buscar.
+        """
+        pending = {label: _keyword_needles(LABEL_KEYWORDS[label]) for label in labels if label not in self._coords}
+        if not pending:
+            return
+        search = self._pending_search(pending)
+
+        # Una palabra clave coincide si aparece como palabra completa en la celda
+        # (la coincidencia exacta queda cubierta por el relleno de espacios).
+        # Las etiquetas están en las primeras filas, así que casi nunca se llega al cuerpo de la tabla.
+        for r_idx, row in enumerate(self._iter_norm_rows()):
             for c_idx, cell in enumerate(row):
-                cell_str = str(cell).upper().strip()
-                if any(k == cell_str or f" {k} " in f" {cell_str} " for k in keywords):
-                    return r_idx, c_idx
-        return None, None
+                # El filtro previo descarta las celdas sin ninguna palabra clave pendiente;
+                # solo en las que pasan se revisa qué etiquetas coinciden
+                if not cell or not search(cell):
+                    continue
+                padded = f" {cell} "
+                found = [label for label, needles in pending.items() if any(k in padded for k in needles)]
+                for label in found:
+                    self._coords[label] = (r_idx, c_idx)
+                    del pending[label]
+                if not pending:
+                    return
+                if found:
+                    search = self._pending_search(pending)
+        self._coords.update(dict.fromkeys(pending, (None, None)))
+
+    def _iter_norm_rows(self):
+        """
+        Recorre las filas en mayúsculas. Cada fila se normaliza una sola vez y solo si algún
+        recorrido llega a ella: las búsquedas que terminan en la cabecera no tocan el resto de la hoja.
+        """
+        norm_rows = self._norm_rows
+        upper = self._upper_cache
+        for r_idx, row in enumerate(self._raw_rows):
+            if r_idx == len(norm_rows):
+                # La mayoría de las celdas se repiten (vacías, etiquetas): cada valor distinto
+                # se convierte una sola vez y las demás apariciones reutilizan el resultado
+                for text in row:
+                    if text not in upper:
+                        upper[text] = text.upper()
+                norm_rows.append([upper[text] for text in row])
+            yield norm_rows[r_idx]
+
+    @staticmethod
+    def _pending_search(pending):
+        """
+        Filtro previo del recorrido: indica si la celda contiene alguna palabra clave pendiente.
+        Con MIN_PATTERN_KEYWORDS o más usa una sola regex; con menos, pruebas directas de subcadena.
+        """
+        keywords = tuple(sorted({k for label in pending for k in LABEL_KEYWORDS[label]}))
+        if len(keywords) >= MIN_PATTERN_KEYWORDS:
+            return _keywords_pattern(keywords).search
+        return lambda cell: any(k in cell for k in keywords)
+
+    def _find_coordinates(self, label):
+        """Busca las coordenadas (fila, columna) de una etiqueta de LABEL_KEYWORDS."""
+        self._locate([label])
+        return self._coords[label]
 
     def _scan_neighborhood(self, r, c, direction='down', max_steps=5):
         """
@@ -32,62 +169,44 @@ class InvoiceParser:
         if r is None or c is None:
             return "N/A"
             
-        for i in range(1, max_steps + 1):
-            try:
-                if direction == 'down':
-                    target_r, target_c = r + i, c
-                elif direction == 'right':
-                    target_r, target_c = r, c + i
-                else:
-                    return "N/A"
-
-                # Verificar límites
-                if target_r >= len(self.raw_data) or target_c >= len(self.raw_data[0]):
-                    continue
+        # Tomamos de una vez el tramo de celdas vecinas: el slicing ya respeta los límites
+        # de la matriz, así que no hace falta verificar índices ni capturar IndexError
+        if direction == 'down':
+            neighbors = self.raw_data[r + 1:r + 1 + max_steps, c]
+        elif direction == 'right':
+            neighbors = self.raw_data[r, c + 1:c + 1 + max_steps]
+        else:
+            return "N/A"
 
-                val = str(self.raw_data[target_r][target_c]).strip()
-                # Si encontramos algo que no sea vacío, lo devolvemos
-                if val: 
-                    return val
-            except IndexError:
-                pass
+        for val in neighbors:
+            # Si encontramos algo que no sea vacío, lo devolvemos
+            if val:
+                return val
         return "N/A"
 
     def extract_date(self):
         """Extrae y formatea la fecha a formato DD/MM/AAAA."""
-        # Buscamos valores saltando posibles celdas vacías debajo de los headers
-        r_d, c_d = self._find_coordinates(["DIA", "DIA / DAY"])
+        # Buscamos valores saltando posibles celdas vacías debajo de los headers.
+        # Si falta una parte ya no buscamos las siguientes: se usará el campo "FECHA".
+        month = year = "N/A"
+        r_d, c_d = self._find_coordinates("DIA")
         day = self._scan_neighborhood(r_d, c_d, direction='down')
-        
-        r_m, c_m = self._find_coordinates(["MES", "MES / MONTH"])
-        month = self._scan_neighborhood(r_m, c_m, direction='down')
-        
-        r_y, c_y = self._find_coordinates(["AÑO", "AÑO / YEAR", "YEAR"])
-        year = self._scan_neighborhood(r_y, c_y, direction='down')
-        
+
+        if day != "N/A":
+            r_m, c_m = self._find_coordinates("MES")
+            month = self._scan_neighborhood(r_m, c_m, direction='down')
+
+        if month != "N/A":
+            r_y, c_y = self._find_coordinates("AÑO")
+            year = self._scan_neighborhood(r_y, c_y, direction='down')
+
         if "N/A" in [day, month, year]:
             # Intento alternativo: Buscar "FECHA" y tomar el valor completo
-            r_f, c_f = self._find_coordinates(["FECHA", "DATE", "FECHA DOCUMENTO"])
+            r_f, c_f = self._find_coordinates("FECHA")
             full_date = self._scan_neighborhood(r_f, c_f, direction='down')
             return full_date if full_date != "N/A" else "N/A"
         
-        # Mapeo de meses a números para formato estándar
-        month_map = {
-            'JANUARY': '01', 'JAN': '01', 'ENERO': '01', 'ENE': '01', '1': '01', '01': '01',
-            'FEBRUARY': '02', 'FEB': '02', 'FEBRERO': '02', '2': '02', '02': '02',
-            'MARCH': '03', 'MAR': '03', 'MARZO': '03', '3': '03', '03': '03',
-            'APRIL': '04', 'APR': '04', 'ABRIL': '04', 'ABR': '04', '4': '04', '04': '04',
-            'MAY': '05', 'MAYO': '05', '5': '05', '05': '05',
-            'JUNE': '06', 'JUN': '06', 'JUNIO': '06', '6': '06', '06': '06',
-            'JULY': '07', 'JUL': '07', 'JULIO': '07', '7': '07', '07': '07',
-            'AUGUST': '08', 'AUG': '08', 'AGOSTO': '08', 'AGO': '08', '8': '08', '08': '08',
-            'SEPTEMBER': '09', 'SEP': '09', 'SEPTIEMBRE': '09', 'SEPT': '09', '9': '09', '09': '09',
-            'OCTOBER': '10', 'OCT': '10', 'OCTUBRE': '10', '10': '10',
-            'NOVEMBER': '11', 'NOV': '11', 'NOVIEMBRE': '11', '11': '11',
-            'DECEMBER': '12', 'DEC': '12', 'DICIEMBRE': '12', 'DIC': '12', '12': '12'
-        }
-        
-        m_num = month_map.get(month.upper(), month)
+        m_num = MONTH_MAP.get(month.upper(), month)
         # Asegurar ceros a la izquierda para día
         d_num = day.zfill(2) if day.isdigit() else day
         
@@ -96,7 +215,7 @@ class InvoiceParser:
     def extract_currency(self):
         """Busca la moneda cerca de 'TOTAL FOB' o etiquetas similares, escaneando a la derecha."""
         # Estrategia 1: Buscar etiqueta "MONEDA"
-        r, c = self._find_coordinates(["MONEDA", "CURRENCY"])
+        r, c = self._find_coordinates("MONEDA")
         if r is not None:
             val = self._scan_neighborhood(r, c, direction='down') # A veces está abajo
             if val == "N/A": 
@@ -104,7 +223,7 @@ class InvoiceParser:
             if val != "N/A": return val
 
         # Estrategia 2: Buscar al lado de "TOTAL FOB" o "TOTAL" (derecha)
-        r, c = self._find_coordinates(["TOTAL FOB", "TOTAL VALUE"])
+        r, c = self._find_coordinates("TOTAL FOB")
         if r is not None:
             # Escanear hasta 5 celdas a la derecha buscando texto (USD, EUR, DÓLAR)
             val = self._scan_neighborhood(r, c, direction='right', max_steps=8)
@@ -115,73 +234,61 @@ class InvoiceParser:
     def extract_products_table(self):
         """
         Extrae productos con tolerancia a filas vacías intermedias.
+        Devuelve la tabla por columnas: {columna: lista de valores}.
         """
-        r_qty, c_qty = self._find_coordinates(["CANTIDAD", "QTY", "QUANTITY"])
-        r_desc, c_desc = self._find_coordinates(["DESCRIPCION", "DESCRIPTION", "MERCHANDISE DESCRIPTION"])
-        r_price, c_price = self._find_coordinates(["PRECIO UNIT", "UNIT PRICE", "PRECIO"])
-        r_total, c_total = self._find_coordinates(["TOTAL", "TOTAL LINEA"])
-
+        # Sin columna de descripción no hay tabla: se comprueba antes de buscar las demás
+        r_desc, c_desc = self._find_coordinates("DESCRIPCION")
         if r_desc is None:
-            return []
+            return {col: [] for col in PRODUCT_COLUMNS}
+
+        r_qty, c_qty = self._find_coordinates("CANTIDAD")
+        r_price, c_price = self._find_coordinates("PRECIO")
+        r_total, c_total = self._find_coordinates("TOTAL")
 
-        products = []
         # Empezamos una fila debajo del encabezado más "profundo" encontrado
         start_r = max(r for r in [r_qty, r_desc, r_price] if r is not None) + 1
-        
-        empty_rows_patience = 0 # Contador para tolerar filas vacías
+
+        # Leemos cada columna de la tabla de una vez (un slice de la matriz) en vez de celda a celda
+        body = self.raw_data[start_r:]
+        missing_col = np.full(len(body), "0", dtype=object)
+        desc_col = body[:, c_desc]
+        # Filas de corte (TOTAL, OBSERVACIONES...) marcadas para toda la columna de una vez
+        stop_col = pd.Series(desc_col, dtype=object).str.upper().str.contains(STOP_WORDS_RE).to_numpy(dtype=bool)
+        qty_col = body[:, c_qty] if c_qty is not None else missing_col
+        price_col = body[:, c_price] if c_price is not None else missing_col
+        total_col = body[:, c_total] if c_total is not None else missing_col
+
         max_patience = 3 # Permitir hasta 3 filas vacías antes de cortar
-        
-        current_r = start_r
-        while current_r < len(self.raw_data):
-            desc_val = str(self.raw_data[current_r][c_desc]).strip() if c_desc is not None else ""
-            
-            # Chequeos de parada
-            is_stop_word = any(x in desc_val.upper() for x in ["TOTAL", "OBSERVACIONES", "NOTES", "SUBTOTAL"])
-            
-            if not desc_val:
-                # Si la celda de descripción está vacía, aumentamos paciencia
-                empty_rows_patience += 1
-                if empty_rows_patience > max_patience:
-                    break # Se acabaron las filas de datos
-            elif is_stop_word:
-                break
-            else:
-                # Encontramos datos, reiniciamos paciencia
-                empty_rows_patience = 0
-                
-                qty_val = self.raw_data[current_r][c_qty] if c_qty is not None else "0"
-                price_val = self.raw_data[current_r][c_price] if c_price is not None else "0"
-                total_val = self.raw_data[current_r][c_total] if c_total is not None else "0"
-                
-                # Limpieza básica de NaN en celdas numéricas
-                qty_val = "" if qty_val == "nan" else qty_val
-                price_val = "" if price_val == "nan" else price_val
-                total_val = "" if total_val == "nan" else total_val
-
-                products.append({
-                    "CANTIDAD": qty_val,
-                    "DESCRIPCION": desc_val,
-                    "PRECIO UNITARIO": price_val,
-                    "TOTAL LINEA": total_val
-                })
-            
-            current_r += 1
-            
-        return products
+
+        # Longitud de la racha de descripciones vacías que termina en cada fila
+        empty = desc_col == ''
+        row_idx = np.arange(len(desc_col))
+        empty_run = row_idx - np.maximum.accumulate(np.where(empty, -1, row_idx))
+
+        # La tabla termina en la primera fila con palabra de corte o al agotar la paciencia
+        is_end = (stop_col & ~empty) | (empty_run > max_patience)
+        end = int(np.argmax(is_end)) if is_end.any() else len(desc_col)
+
+        # Filas con datos antes del corte (los NaN ya se limpiaron en __init__)
+        keep = ~empty[:end]
+        return {
+            col: values[:end][keep].tolist()
+            for col, values in zip(PRODUCT_COLUMNS, (qty_col, desc_col, price_col, total_col))
+        }
     
     def extract_observations(self):
         """Busca observaciones bajo 'Country of Origin' o etiquetas estándar."""
         
         # Estrategia 1: Prioridad solicitada - Buscar debajo de "COUNTRY OF ORIGIN"
         # Buscamos coincidencias flexibles
-        r, c = self._find_coordinates(["COUNTRY OF ORIGIN", "COUNTRY OF ORIGIN: CHILE", "ORIGIN: CHILE"])
+        r, c = self._find_coordinates("ORIGEN")
         if r is not None:
             # Escaneamos hacia abajo buscando el primer texto no vacío
             val = self._scan_neighborhood(r, c, direction='down', max_steps=5)
             if val != "N/A": return val
 
         # Estrategia 2: Buscar por etiquetas estándar de observaciones (Fallback)
-        r, c = self._find_coordinates(["OBSERVACIONES", "OBSERVATIONS", "NOTES", "COMENTARIOS"])
+        r, c = self._find_coordinates("OBSERVACIONES")
         if r is not None:
             # Intentar leer abajo
             val = self._scan_neighborhood(r, c, direction='down', max_steps=2)
@@ -193,30 +300,33 @@ class InvoiceParser:
         return ""
 
     def process(self):
+        # Las etiquetas que se leen siempre se ubican todas en un mismo recorrido de la hoja
+        self._locate(CORE_LABELS)
+
         # 1. Extracción de Cabecera usando Neighborhood Scan
-        r_cli, c_cli = self._find_coordinates(["CLIENTE", "CUSTOMER"])
+        r_cli, c_cli = self._find_coordinates("CLIENTE")
         cliente = self._scan_neighborhood(r_cli, c_cli, direction='down')
         
-        r_exp, c_exp = self._find_coordinates(["EXP", "EXP N°", "REF EXP"])
+        r_exp, c_exp = self._find_coordinates("EXP")
         exp = self._scan_neighborhood(r_exp, c_exp, direction='down')
         
         fecha_unificada = self.extract_date()
         
         # Condición de Venta
-        r_cond, c_cond = self._find_coordinates(["CONDICION VENTA", "CONDICION DE VENTA", "TERMS OF SALE"])
+        r_cond, c_cond = self._find_coordinates("CONDICION VENTA")
         raw_cond = self._scan_neighborhood(r_cond, c_cond, direction='down')
         if raw_cond != "N/A":
-            parts = re.split(r'\s*[-–]\s*', raw_cond)
+            parts = CONDICION_SEPARATOR_RE.split(raw_cond)
             tipo_venta = parts[0].strip() if len(parts) > 0 else "N/A"
             incoterm = parts[1].strip() if len(parts) > 1 else "N/A"
         else:
             tipo_venta, incoterm = "N/A", "N/A"
 
         # Puertos
-        r_pe, c_pe = self._find_coordinates(["PUERTO EMBARQUE", "PORT OF LOADING"])
+        r_pe, c_pe = self._find_coordinates("PUERTO EMBARQUE")
         puerto_emb = self._scan_neighborhood(r_pe, c_pe, direction='down')
         
-        r_pd, c_pd = self._find_coordinates(["PUERTO DESTINO", "PORT OF DESTINATION", "DISCHARGING PORT"])
+        r_pd, c_pd = self._find_coordinates("PUERTO DESTINO")
         puerto_dest = self._scan_neighborhood(r_pd, c_pd, direction='down')
         
         moneda = self.extract_currency()
@@ -226,7 +336,6 @@ class InvoiceParser:
         products = self.extract_products_table()
         
         # 3. Construcción Flat Table
-        output_rows = []
         header_data = {
             "CLIENTE": cliente,
             "EXP": exp,
@@ -239,17 +348,43 @@ class InvoiceParser:
             "OBSERVACIONES": observaciones
         }
         
-        if not products:
-            row = header_data.copy()
-            row.update({"CANTIDAD": "", "DESCRIPCION": "", "PRECIO UNITARIO": "", "TOTAL LINEA": ""})
-            output_rows.append(row)
-        else:
-            for prod in products:
-                row = header_data.copy()
-                row.update(prod)
-                output_rows.append(row)
-                
-        return pd.DataFrame(output_rows)
+        if not products["DESCRIPCION"]:
+            products = {col: [""] for col in PRODUCT_COLUMNS}
+
+        # Los productos ya vienen por columnas: un solo constructor arma el DataFrame, difunde
+        # los valores de cabecera a todas las filas y deja sus columnas al principio
+        return pd.DataFrame({**header_data, **products})
+
+@st.cache_data(show_spinner=False, max_entries=128)
+def _process_bytes(name, content):
+    """Procesa un archivo desde sus bytes. Streamlit cachea el resultado por contenido entre reruns."""
+    # calamine (lector en Rust) lee solo valores y soporta tanto .xlsx como .xls
+    df_raw = pd.read_excel(io.BytesIO(content), header=None, engine="calamine")
+    df_result = InvoiceParser(df_raw).process()
+    df_result.insert(0, "ARCHIVO_ORIGEN", name)
+    return df_result
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _excel_bytes(uploads, _df):
+    """
+    Genera el reporte Excel con xlsxwriter en modo constant_memory: cada fila se vuelca
+    al archivo al escribirse, sin mantener la hoja completa en memoria.
+    Se escribe fila por fila porque ese modo exige orden de filas (to_excel escribe por columnas).
+    Las cadenas se escriben tal cual: strings_to_urls=False evita que textos con forma de URL
+    se conviertan en hipervínculos (o se descarten si superan los límites de Excel).
+    Streamlit cachea el resultado por los archivos procesados (pares nombre, contenido), igual que
+    _process_bytes, así que los reruns no lo regeneran. _df no entra en la clave (el guion bajo
+    lo excluye del hash): Streamlit solo muestrea los DataFrames grandes al hashearlos.
+    """
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'strings_to_urls': False})
+    worksheet = workbook.add_worksheet()
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    worksheet.write_row(0, 0, _df.columns, header_format)
+    for r_idx, row in enumerate(_df.itertuples(index=False, name=None), start=1):
+        worksheet.write_row(r_idx, 0, row)
+    workbook.close()
+    return output.getvalue()
 
 # ==========================================
 # INTERFAZ DE USUARIO STREAMLIT (Igual que antes)
@@ -266,29 +401,30 @@ def main():
 
     if uploaded_files:
         all_data = []
+        # Archivos procesados sin error, que identifican el reporte en el caché de la descarga
+        processed = []
         progress_bar = st.progress(0)
         
-        for i, file in enumerate(uploaded_files):
-            try:
-                df_raw = pd.read_excel(file, header=None)
-                parser = InvoiceParser(df_raw)
-                df_result = parser.process()
-                df_result.insert(0, "ARCHIVO_ORIGEN", file.name)
-                all_data.append(df_result)
-            except Exception as e:
-                st.error(f"❌ Error en {file.name}: {str(e)}")
-            progress_bar.progress((i + 1) / len(uploaded_files))
+        # Cada archivo es independiente: se procesan en paralelo y los resultados
+        # se recogen en el orden de subida (los avisos de Streamlit quedan en este hilo)
+        with ThreadPoolExecutor(max_workers=min(8, len(uploaded_files))) as executor:
+            uploads = [(file.name, file.getvalue()) for file in uploaded_files]
+            futures = [executor.submit(_process_bytes, name, content) for name, content in uploads]
+
+            for i, (upload, future) in enumerate(zip(uploads, futures)):
+                try:
+                    all_data.append(future.result())
+                    processed.append(upload)
+                except Exception as e:
+                    st.error(f"❌ Error en {upload[0]}: {str(e)}")
+                progress_bar.progress((i + 1) / len(uploaded_files))
 
         if all_data:
             final_df = pd.concat(all_data, ignore_index=True)
             st.success("✅ Procesamiento completado")
             st.dataframe(final_df, use_container_width=True)
             
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                final_df.to_excel(writer, index=False)
-            
-            st.download_button("📥 Descargar Reporte", output.getvalue(), "reporte_exportacion.xlsx")
+            st.download_button("📥 Descargar Reporte", _excel_bytes(tuple(processed), final_df), "reporte_exportacion.xlsx")
 
 if __name__ == "__main__":
     main()